@@ -1,138 +1,481 @@
+import numpy as np
 import torch
 from transformers import pipeline
 from transformers.utils import is_flash_attn_2_available
 import os
-import psycopg2
-from datetime import datetime
+import io
+import csv
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+import math
+from datetime import datetime, time
 from pathlib import Path
-from pydub import AudioSegment
+import subprocess
 import tempfile
-import re
+import queue
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import cache
 from typing import List
 
-def convert_to_flac(input_path: str) -> str:
-    """Converts audio to FLAC and returns path to temporary file"""
-    audio = AudioSegment.from_file(input_path)
-    temp_path = tempfile.mktemp(suffix='.flac')
-    audio.export(temp_path, format='flac')
-    return temp_path
+SAMPLING_RATE = 16000
 
-def transcribe_audio(file_path: str):
-    flac_path = convert_to_flac(file_path)
-    try:
-        pipe = pipeline(
-            "automatic-speech-recognition",
-            model="openai/whisper-large-v3",
-            torch_dtype=torch.float16,
-            device="cuda:0",
-            model_kwargs={"attn_implementation": "flash_attention_2"} 
-            if is_flash_attn_2_available() 
-            else {"attn_implementation": "sdpa"},
-        )
+# Whisper's context window; the pipeline splits its inputs into strided windows of this length
+CHUNK_SECONDS = 30
+
+# Audio is streamed in blocks of this length so memory stays bounded on long
+# recordings; consecutive blocks overlap so no speech is cut at a block seam
+BLOCK_SECONDS = 600
+BLOCK_OVERLAP_SECONDS = 30
+
+# Approximate VRAM one 30s chunk needs at fp16 with segment-level timestamps
+BYTES_PER_BATCH_ITEM = 600 * 1024 * 1024
+
+DB_PARAMS = {
+    'dbname': "audio_notes",
+    'user': "postgres",
+    'password': "postgres",
+    'host': "localhost"
+}
+
+# Created on first use so importing this module does not need a running database
+POOL = None
+_pool_lock = threading.Lock()
+
+# Per-file statements that cannot be batched; parsed and planned once per connection
+PREPARED_STATEMENTS = {
+    'mark_processed': "UPDATE files SET processed = TRUE WHERE filepath = $1 RETURNING id",
+}
+_prepared = set()
+
+# ASR backend: "transformers" (default) or "faster-whisper" (CTranslate2, INT8 weights)
+BACKEND = os.environ.get("WHISPER_BACKEND", "transformers")
+
+def load_audio(input_path: str) -> np.ndarray:
+    """Decodes audio to a mono float32 waveform at Whisper's sampling rate"""
+    # ffmpeg resamples and writes raw 16-bit PCM to stdout, no intermediate file
+    out = subprocess.run([
+        "ffmpeg", "-i", input_path,
+        "-f", "s16le", "-ac", "1", "-ar", str(SAMPLING_RATE),
+        "-loglevel", "error", "-"
+    ], capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+def stream_audio(input_path: str, seconds: int = CHUNK_SECONDS):
+    """Decodes audio with ffmpeg and yields it as consecutive float32 waveforms of `seconds` each.
+
+    Only one piece is held in memory at a time, however long the recording is.
+    """
+    cmd = [
+        "ffmpeg", "-i", input_path,
+        "-f", "s16le", "-ac", "1", "-ar", str(SAMPLING_RATE),
+        "-loglevel", "error", "-"
+    ]
+    piece_bytes = seconds * SAMPLING_RATE * 2
+    # stderr goes to a file so a chatty ffmpeg cannot block on a full pipe
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, bufsize=piece_bytes)
+        try:
+            while data := proc.stdout.read(piece_bytes):
+                yield np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr.read())
+
+def decode_error(e: Exception) -> str:
+    """Describes a decoding failure, including ffmpeg's own error output when there is any"""
+    stderr = getattr(e, 'stderr', None)
+    if stderr:
+        return f"{e}: {stderr.decode(errors='replace').strip()}"
+    return str(e)
+
+def decoded_files(file_paths: List[str]):
+    """Yields (file_path, array) for every file that decodes"""
+    for file_path in file_paths:
+        try:
+            yield file_path, load_audio(file_path)
+        except Exception as e:
+            print(f"Error loading {file_path}: {decode_error(e)}")
+
+def decoded_blocks(file_paths: List[str]):
+    """Yields (file_path, offset_seconds, array, is_first, is_last) for the blocks of every file.
+
+    Each block after the first starts with the last BLOCK_OVERLAP_SECONDS of the
+    block before it. A file's last block is only yielded once ffmpeg has finished
+    without error, so a file that fails midway never gets an is_last block.
+    """
+    overlap = BLOCK_OVERLAP_SECONDS * SAMPLING_RATE
+    for file_path in file_paths:
+        try:
+            offset = 0.0
+            is_first = True
+            previous = None
+            for piece in stream_audio(file_path, BLOCK_SECONDS - BLOCK_OVERLAP_SECONDS):
+                if previous is None:
+                    block = piece
+                else:
+                    yield file_path, offset, previous, is_first, False
+                    is_first = False
+                    offset += (len(previous) - overlap) / SAMPLING_RATE
+                    block = np.concatenate((previous[-overlap:], piece))
+                previous = block
+            if previous is None:
+                print(f"No audio in {file_path}, skipping")
+            else:
+                yield file_path, offset, previous, is_first, True
+        except Exception as e:
+            print(f"Error loading {file_path}: {decode_error(e)}")
+
+def prefetch(items, depth: int):
+    """Pulls items from an iterator on a background thread and yields them.
+
+    At most `depth` items wait in memory, so ffmpeg keeps decoding while the
+    GPU is busy with what was decoded before.
+    """
+    loaded = queue.Queue(maxsize=depth)
+
+    def producer():
+        try:
+            for item in items:
+                loaded.put(item)
+        finally:
+            loaded.put(None)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while (item := loaded.get()) is not None:
+        yield item
+
+@cache
+def attn_impl() -> str:
+    """Picks the attention kernel once, on first use, overridable with WHISPER_ATTN.
+
+    FlashAttention 2 needs Ampere or newer and regresses on ROCm, so fall back to SDPA there.
+    """
+    return os.environ.get("WHISPER_ATTN") or (
+        "flash_attention_2"
+        if is_flash_attn_2_available()
+        and torch.cuda.is_available()
+        and torch.version.hip is None
+        and torch.cuda.get_device_capability()[0] >= 8
+        else "sdpa"
+    )
+
+def build_pipe():
+    """Builds the Whisper pipeline once so the weights stay on the GPU across files"""
+    pipe = pipeline(
+        "automatic-speech-recognition",
+        model="openai/whisper-large-v3",
+        torch_dtype=torch.float16,
+        device="cuda:0",
+        model_kwargs={"attn_implementation": attn_impl()},
+    )
+    print(f"Using attention implementation: {attn_impl()}")
+    
+    # Move model to GPU after initialization
+    pipe.model = pipe.model.to("cuda:0")
+    
+    # The mel input is always (batch, 128, 3000), so cuDNN can pick the conv
+    # algorithms once during warm-up and reuse them; TF32 covers any fp32 matmuls
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    
+    # Fuse the encoder's kernels
+    torch.backends.cuda.enable_flash_sdp(True)
+    pipe.model.model.encoder = torch.compile(
+        pipe.model.model.encoder, mode="reduce-overhead", fullgraph=False
+    )
+    return pipe
+
+def pick_batch_size() -> int:
+    """Sizes batches to the VRAM left free once the model is loaded"""
+    free, _ = torch.cuda.mem_get_info()
+    return max(8, min(64, int(free / BYTES_PER_BATCH_ITEM)))
+
+def warm_up(pipe, batch_size: int):
+    """Runs a full batch of silent 30s clips so compilation happens before real files"""
+    silence = np.zeros(CHUNK_SECONDS * SAMPLING_RATE, dtype=np.float32)
+    pipe(
+        [{"array": silence, "sampling_rate": SAMPLING_RATE} for _ in range(batch_size)],
+        batch_size=batch_size,
+        generate_kwargs={"language": "en", "num_beams": 1}
+    )
+
+def transcribe_files(pipe, file_paths: List[str], batch_size: int):
+    """Transcribes all files in one pipeline call so batches span file boundaries.
+
+    Files are streamed in overlapping BLOCK_SECONDS blocks, each one pipeline
+    input that the pipeline splits into strided CHUNK_SECONDS windows. Yields
+    (file_path, result) pairs in the order the files were given.
+    """
+    # The pipeline returns one result per input in input order, so the
+    # blocks handed out so far line up with its outputs
+    pending = deque()
+
+    def inputs():
+        for file_path, offset, array, is_first, is_last in prefetch(decoded_blocks(file_paths), depth=2):
+            duration = len(array) / SAMPLING_RATE
+            # Both blocks around a seam transcribe the overlap; each keeps the
+            # segments starting on its own side of the overlap's midpoint
+            keep_from = 0.0 if is_first else BLOCK_OVERLAP_SECONDS / 2
+            keep_until = math.inf if is_last else duration - BLOCK_OVERLAP_SECONDS / 2
+            pending.append((file_path, offset, duration, keep_from, keep_until, is_last))
+            yield {"array": array, "sampling_rate": SAMPLING_RATE}
+
+    # Language parameter goes in the generation call
+    results = pipe(
+        inputs(),
+        chunk_length_s=CHUNK_SECONDS,
+        batch_size=batch_size,
+        # Segment-level timestamps; word-level ones need several times the VRAM
+        return_timestamps=True,
+        # Greedy decoding keeps a single hypothesis per chunk in decoder memory
+        generate_kwargs={"language": "en", "num_beams": 1}
+    )
+    
+    current, chunks = None, []
+    for result in results:
+        file_path, offset, duration, keep_from, keep_until, is_last = pending.popleft()
+        if file_path != current:
+            # A file that failed to decode midway never sent its last block
+            current, chunks = file_path, []
         
-        # Move model to GPU after initialization
-        pipe.model = pipe.model.to("cuda:0")
+        for chunk in result['chunks']:
+            start, end = chunk['timestamp']
+            if start is not None and not keep_from <= start < keep_until:
+                continue
+            # Speech running to the end of the block leaves the last segment
+            # without an end timestamp; it ends where the block does
+            if end is None:
+                end = duration
+            chunks.append({
+                'timestamp': (
+                    start + offset if start is not None else None,
+                    end + offset
+                ),
+                'text': chunk['text']
+            })
         
-        # Language parameter moved to the generation call
-        return pipe(
-            flac_path,
-            chunk_length_s=30,
-            batch_size=24,
-            return_timestamps=True,
-            generate_kwargs={"language": "en"}  # Language parameter goes here
-        )
-    finally:
-        os.remove(flac_path)
+        if is_last:
+            yield file_path, {'text': ''.join(c['text'] for c in chunks), 'chunks': chunks}
+            current = None
+
+def build_faster_whisper():
+    """Builds a CTranslate2 Whisper model with INT8 weights and FP16 activations"""
+    from faster_whisper import WhisperModel, BatchedInferencePipeline
+
+    model = WhisperModel("large-v3", device="cuda", compute_type="int8_float16")
+    return BatchedInferencePipeline(model=model)
+
+def transcribe_files_faster_whisper(batched, file_paths: List[str], batch_size: int):
+    """Transcribes files one by one with faster-whisper.
+
+    Yields (file_path, result) pairs shaped like the transformers pipeline output.
+    """
+    for file_path, array in prefetch(decoded_files(file_paths), depth=2):
+        try:
+            segments, info = batched.transcribe(
+                array,
+                batch_size=batch_size,
+                language="en",
+                word_timestamps=False
+            )
+            chunks = [{'timestamp': (s.start, s.end), 'text': s.text} for s in segments]
+        except Exception as e:
+            print(f"Error transcribing {file_path}: {e}")
+            continue
+        yield file_path, {'text': ''.join(c['text'] for c in chunks), 'chunks': chunks}
 
 def first_step():
     db = AudioDatabase("rec")
     unprocessed = db.get_unprocessed_files()
     print(f"Found {len(unprocessed)} files to process")
     
-    for file_path in unprocessed:
+    if BACKEND == "faster-whisper":
+        batched = build_faster_whisper()
+        results = transcribe_files_faster_whisper(batched, unprocessed, pick_batch_size())
+        model = 'faster-whisper-large-v3-int8'
+    else:
+        pipe = build_pipe()
+        # Measure free memory before warm-up fills the allocator cache
+        batch_size = pick_batch_size()
+        warm_up(pipe, batch_size)
+        results = transcribe_files(pipe, unprocessed, batch_size)
+        model = 'whisper-large-v3'
+    
+    def store(file_path, result):
         try:
-            result = transcribe_audio(file_path)
-            db.store_transcription(file_path, result)
+            db.store_transcription(file_path, result, model)
             print(f"Successfully processed: {file_path}")
         except Exception as e:
             print(f"Error processing {file_path}: {e}")
+    
+    # A writer thread commits results on its own pooled connection while the GPU
+    # moves on to the next batch
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        try:
+            for file_path, result in results:
+                writer.submit(store, file_path, result)
+        except Exception as e:
+            # Files not yet stored stay unprocessed and are picked up on the next run
+            print(f"Error during transcription: {e}")
+
+
+def ts_to_time(seconds: float) -> time:
+    """Converts an offset in seconds into the recording to a time of day"""
+    s, us = divmod(round(seconds * 1_000_000), 1_000_000)
+    return time(s // 3600 % 24, s // 60 % 60, s % 60, us)
+
+@contextmanager
+def db_connection():
+    """Borrows a pooled connection as one transaction, committed on success and rolled back on error"""
+    global POOL
+    with _pool_lock:
+        if POOL is None:
+            POOL = ThreadedConnectionPool(1, 8, **DB_PARAMS)
+    conn = POOL.getconn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        POOL.putconn(conn)
 
+def execute_prepared(cur, name: str, params: tuple):
+    """Executes one of PREPARED_STATEMENTS, preparing it on the cursor's connection first if needed"""
+    # Prepared statements belong to the session and survive a transaction rollback
+    key = (cur.connection, name)
+    if key not in _prepared:
+        cur.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        _prepared.add(key)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
 
 class AudioDatabase:
     def __init__(self, audio_folder):
         self.audio_folder = audio_folder
-        self.conn = psycopg2.connect(
-            dbname="audio_notes",
-            user="postgres",
-            password="postgres",
-            host="localhost"
-        )
-        self.cursor = self.conn.cursor()
         self._ensure_tables_exist()
     
     def _ensure_tables_exist(self):
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS files (
-                id SERIAL PRIMARY KEY,
-                filepath VARCHAR(255) UNIQUE NOT NULL,
-                filesize BIGINT NOT NULL,
-                date_created TIMESTAMP NOT NULL,
-                duration_seconds FLOAT NOT NULL,
-                processed BOOLEAN DEFAULT FALSE
-            )
-        """)
-        
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transcripts (
-                id SERIAL PRIMARY KEY,
-                file_id INTEGER REFERENCES files(id),
-                date_recorded DATE NOT NULL,
-                time_from TIME NOT NULL,
-                time_to TIME NOT NULL,
-                transcript TEXT NOT NULL,
-                model TEXT NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        self.conn.commit()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id SERIAL PRIMARY KEY,
+                    filepath VARCHAR(255) UNIQUE NOT NULL,
+                    filesize BIGINT NOT NULL,
+                    date_created TIMESTAMP NOT NULL,
+                    duration_seconds FLOAT NOT NULL,
+                    processed BOOLEAN DEFAULT FALSE
+                )
+            """)
+            
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    id SERIAL PRIMARY KEY,
+                    file_id INTEGER REFERENCES files(id),
+                    date_recorded DATE NOT NULL,
+                    time_from TIME NOT NULL,
+                    time_to TIME NOT NULL,
+                    transcript TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Serves joining each file's transcripts in time order for sentence splitting
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_transcripts_file_time
+                ON transcripts (file_id, time_from)
+            """)
+            
+            # Only unprocessed files are indexed, ordered the way they are fetched
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_files_unprocessed
+                ON files (duration_seconds) WHERE processed = FALSE
+            """)
+            
+            # Bulk-load target for new file metadata; unlogged since rows only
+            # live there for the length of one registration transaction
+            cur.execute("""
+                CREATE UNLOGGED TABLE IF NOT EXISTS files_stage (
+                    filepath VARCHAR(255) NOT NULL,
+                    filesize BIGINT NOT NULL,
+                    date_created TIMESTAMP NOT NULL,
+                    duration_seconds FLOAT NOT NULL
+                )
+            """)
     
     def get_file_metadata(self, filepath):
-        audio = AudioSegment.from_file(filepath)
+        # Read the duration from the container header instead of decoding the audio
+        duration = subprocess.check_output([
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration",
+            "-of", "default=nk=1:np=1",
+            str(filepath)
+        ])
+        try:
+            duration_seconds = float(duration)
+        except ValueError:
+            # ffprobe prints N/A when the container header has no duration; count
+            # the decoded samples piece by piece so the waveform is never held whole
+            duration_seconds = sum(len(piece) for piece in stream_audio(str(filepath))) / SAMPLING_RATE
         return {
             'filepath': str(filepath),
             'filesize': os.path.getsize(filepath),
             'date_created': datetime.fromtimestamp(os.path.getctime(filepath)),
-            'duration_seconds': len(audio) / 1000.0
+            'duration_seconds': duration_seconds
         }
     
     def get_unprocessed_files(self):
-        audio_files = []
-        for file in Path(self.audio_folder).glob('*.m4a'):
-            metadata = self.get_file_metadata(file)
-            
-            self.cursor.execute("""
-                INSERT INTO files (filepath, filesize, date_created, duration_seconds)
-                VALUES (%(filepath)s, %(filesize)s, %(date_created)s, %(duration_seconds)s)
-                ON CONFLICT (filepath) DO NOTHING
-            """, metadata)
+        with db_connection() as conn, conn.cursor() as cur:
+            # Only probe files that are not registered yet
+            cur.execute("SELECT filepath FROM files")
+            known = {row[0] for row in cur.fetchall()}
+        new_files = [f for f in Path(self.audio_folder).glob('*.m4a') if str(f) not in known]
+        
+        def probe(filepath):
+            try:
+                return self.get_file_metadata(filepath)
+            except Exception as e:
+                # Unreadable files are left unregistered and retried on the next run
+                print(f"Error reading metadata for {filepath}: {decode_error(e)}")
         
-        self.cursor.execute("""
-            SELECT filepath FROM files 
-            WHERE processed = FALSE
-        """)
-        self.conn.commit()
+        # ffprobe calls spend their time waiting on the subprocess, so run them in parallel
+        with ThreadPoolExecutor(max_workers=8) as probes:
+            metadata = [m for m in probes.map(probe, new_files) if m is not None]
         
-        return [row[0] for row in self.cursor.fetchall()]
-    
-    def __del__(self):
-        self.cursor.close()
-        self.conn.close()
-
-    def store_transcription(self, filepath: str, transcription_result: dict):
-        # Get file_id
-        self.cursor.execute("SELECT id FROM files WHERE filepath = %s", (filepath,))
-        file_id = self.cursor.fetchone()[0]
+        rows = io.StringIO()
+        csv.writer(rows).writerows(
+            (m['filepath'], m['filesize'], m['date_created'].isoformat(), m['duration_seconds'])
+            for m in metadata
+        )
+        rows.seek(0)
         
+        with db_connection() as conn, conn.cursor() as cur:
+            # COPY into the staging table, then move new rows over in one statement
+            cur.execute("TRUNCATE files_stage")
+            cur.copy_expert("""
+                COPY files_stage (filepath, filesize, date_created, duration_seconds)
+                FROM STDIN WITH CSV
+            """, rows)
+            cur.execute("""
+                INSERT INTO files (filepath, filesize, date_created, duration_seconds)
+                SELECT filepath, filesize, date_created, duration_seconds FROM files_stage
+                ON CONFLICT (filepath) DO NOTHING
+            """)
+            cur.execute("TRUNCATE files_stage")
+            
+            cur.execute("""
+                SELECT filepath FROM files 
+                WHERE processed = FALSE
+                ORDER BY duration_seconds
+            """)
+            return [row[0] for row in cur.fetchall()]
+
+    def store_transcription(self, filepath: str, transcription_result: dict, model: str = 'whisper-large-v3'):
         # Date parsing code remains the same...
         date_str = os.path.basename(filepath).split('.')[0]
         try:
@@ -143,113 +486,98 @@ class AudioDatabase:
             except ValueError:
                 raise ValueError(f"File name {date_str} must be in YYYY_MM_DD or DD_MM_YYYY format")
         
-        # Store each chunk with its timestamps, with proper error handling
-        for chunk in transcription_result['chunks']:
-            # Skip chunks with invalid timestamps
-            if not chunk['timestamp'] or None in chunk['timestamp']:
-                continue
+        with db_connection() as conn, conn.cursor() as cur:
+            # Mark file as processed and get its id in one round trip; both
+            # only take effect if the transcripts below are stored too
+            execute_prepared(cur, 'mark_processed', (filepath,))
+            file_id = cur.fetchone()[0]
             
-            try:
-                # Simple conversion without timezone handling
-                time_from = datetime.fromtimestamp(chunk['timestamp'][0]).time()
-                time_to = datetime.fromtimestamp(chunk['timestamp'][1]).time()
+            # Collect each chunk with its timestamps, with proper error handling
+            rows = []
+            for chunk in transcription_result['chunks']:
+                timestamp = chunk['timestamp']
+                
+                # Skip chunks with missing or invalid timestamps
+                if (not isinstance(timestamp, (tuple, list)) or len(timestamp) != 2
+                        or None in timestamp or not all(map(math.isfinite, timestamp))):
+                    continue
                 
-                self.cursor.execute("""
-                    INSERT INTO transcripts 
-                    (file_id, date_recorded, time_from, time_to, transcript, model)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
+                rows.append((
                     file_id,
                     date_recorded,
-                    time_from,
-                    time_to,
+                    ts_to_time(timestamp[0]),
+                    ts_to_time(timestamp[1]),
                     chunk['text'],
-                    'whisper-large-v3'
+                    model
                 ))
-            except (TypeError, ValueError) as e:
-                print(f"Warning: Skipping chunk due to invalid timestamp: {e}")
-                continue
-        
-        # Mark file as processed
-        self.cursor.execute("""
-            UPDATE files SET processed = TRUE 
-            WHERE id = %s
-        """, (file_id,))
-        
-        self.conn.commit()
+            
+            # Store all chunks in one round trip
+            execute_values(cur, """
+                INSERT INTO transcripts 
+                (file_id, date_recorded, time_from, time_to, transcript, model)
+                VALUES %s
+            """, rows, page_size=500)
 
 class PostProcessing:
     def __init__(self):
-        self.conn = psycopg2.connect(
-            dbname="audio_notes",
-            user="postgres",
-            password="postgres",
-            host="localhost"
-        )
-        self.cursor = self.conn.cursor()
         self._ensure_tables_exist()
     
     def _ensure_tables_exist(self):
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sentences (
-                id SERIAL PRIMARY KEY,
-                file_id INTEGER REFERENCES files(id),
-                sentence TEXT NOT NULL,
-                word_count INTEGER NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        self.conn.commit()
-    
-    def process_file_transcripts(self, file_id: int) -> List[str]:
-        # Get all transcripts for the file, ordered by time
-        self.cursor.execute("""
-            SELECT transcript 
-            FROM transcripts 
-            WHERE file_id = %s 
-            ORDER BY time_from
-        """, (file_id,))
-        
-        # Combine all transcripts into one text
-        transcripts = self.cursor.fetchall()
-        full_text = ' '.join(transcript[0] for transcript in transcripts)
-        
-        # Split into sentences and clean them
-        sentences = [s.strip() for s in re.split(r'[.!?]+', full_text) if s.strip()]
-        
-        # Store sentences
-        for sentence in sentences:
-            word_count = len(sentence.split())
-            self.cursor.execute("""
-                INSERT INTO sentences (file_id, sentence, word_count)
-                VALUES (%s, %s, %s)
-            """, (file_id, sentence, word_count))
-        
-        self.conn.commit()
-        return sentences
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS sentences (
+                    id SERIAL PRIMARY KEY,
+                    file_id INTEGER REFERENCES files(id),
+                    sentence TEXT NOT NULL,
+                    word_count INTEGER NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Serves the anti-join that finds files without sentences
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sentences_file_id
+                ON sentences (file_id)
+            """)
     
     def process_all_unprocessed(self):
-        # Get all files that have transcripts but no sentences
-        self.cursor.execute("""
-            SELECT DISTINCT f.id 
-            FROM files f
-            JOIN transcripts t ON f.id = t.file_id
-            LEFT JOIN sentences s ON f.id = s.file_id
-            WHERE s.id IS NULL AND f.processed = TRUE
-        """)
-        
-        file_ids = [row[0] for row in self.cursor.fetchall()]
+        # Join, split and count every pending file's transcripts server-side in one
+        # statement, for files that have transcripts but no sentences yet
+        try:
+            with db_connection() as conn, conn.cursor() as cur:
+                cur.execute(r"""
+                    WITH pending AS (
+                        SELECT f.id
+                        FROM files f
+                        WHERE f.processed = TRUE
+                          AND EXISTS (SELECT 1 FROM transcripts t WHERE t.file_id = f.id)
+                          AND NOT EXISTS (SELECT 1 FROM sentences s WHERE s.file_id = f.id)
+                    ),
+                    full_texts AS (
+                        SELECT t.file_id, string_agg(t.transcript, ' ' ORDER BY t.time_from) AS full_text
+                        FROM transcripts t
+                        JOIN pending p ON p.id = t.file_id
+                        GROUP BY t.file_id
+                    ),
+                    parts AS (
+                        SELECT ft.file_id, s.n, regexp_replace(s.part, '^\s+|\s+$', '', 'g') AS sentence
+                        FROM full_texts ft,
+                             regexp_split_to_table(ft.full_text, '[.!?]+') WITH ORDINALITY AS s(part, n)
+                    )
+                    INSERT INTO sentences (file_id, sentence, word_count)
+                    SELECT file_id, sentence, array_length(regexp_split_to_array(sentence, '\s+'), 1)
+                    FROM parts
+                    WHERE sentence <> ''
+                    ORDER BY file_id, n
+                    RETURNING file_id
+                """)
+                counts = Counter(row[0] for row in cur.fetchall())
+        except Exception as e:
+            print(f"Error processing transcripts: {e}")
+            return
         
-        for file_id in file_ids:
-            try:
-                sentences = self.process_file_transcripts(file_id)
-                print(f"Processed file {file_id}: {len(sentences)} sentences extracted")
-            except Exception as e:
-                print(f"Error processing file {file_id}: {e}")
-    
-    def __del__(self):
-        self.cursor.close()
-        self.conn.close()
+        for file_id, count in sorted(counts.items()):
+            print(f"Processed file {file_id}: {count} sentences extracted")
 
 
 